@@ -1,67 +1,122 @@
-from flask import Flask, render_template, request, redirect, session, url_for, abort
+from flask import Flask, render_template, request, redirect, session, url_for, abort, g, make_response
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerifyMismatchError
+from sqlalchemy import event, exists, func, lambda_stmt, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import raiseload, selectinload
+from sqlalchemy.pool import QueuePool
+from werkzeug.security import check_password_hash
+import hashlib
 import os
+import sqlite3
+import struct
+import time
 
 
 class Config:
-    SECRET_KEY = os.urandom(24)
+    # Set SECRET_KEY to a fixed value in production so every worker accepts the same sessions
+    SECRET_KEY = os.environ.get("SECRET_KEY") or os.urandom(24)
     SQLALCHEMY_DATABASE_URI = "sqlite:///saveablood.db"
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Keep a pool of open connections instead of re-opening the db file per request
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        "poolclass": QueuePool,
+        "pool_size": 10,
+        "max_overflow": 20,
+        "pool_pre_ping": True,
+        "connect_args": {"check_same_thread": False, "timeout": 30},
+        "query_cache_size": 1200,
+    }
+
+
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Enables WAL so readers don't block on the single writer."""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=30000")
+    cursor.execute("PRAGMA cache_size=-20000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
 
 
 app = Flask(__name__)
 app.config.from_object(Config)
 db = SQLAlchemy(app)
 
+# Argon2id tuned for ~7MB / 1 pass; shared so the parameters are only set up once.
+# argon2-cffi releases the GIL while hashing, so request threads hash in parallel.
+password_hasher = PasswordHasher(time_cost=1, memory_cost=7168, parallelism=1)
+
+
+def hash_password(password):
+    """Returns an Argon2id hash of password."""
+    return password_hasher.hash(password)
+
+
+def verify_password(password_hash, password):
+    """Checks password against a stored hash."""
+    if not password_hash.startswith('$argon2'):
+        # Accounts created before the switch still carry Werkzeug hashes
+        return check_password_hash(password_hash, password)
+    try:
+        return password_hasher.verify(password_hash, password)
+    except (VerifyMismatchError, InvalidHashError):
+        return False
+
 
 # --- Database Models ---
 
+# Slot of each blood type in the packed BloodBank.inventory column
+BTYPE_IDX = {'A+': 0, 'B+': 1, 'O+': 2, 'AB+': 3, 'A-': 4, 'B-': 5, 'O-': 6, 'AB-': 7}
+# Precompiled layouts of the whole column and of a single slot
+INVENTORY_STRUCT = struct.Struct('<8i')
+UNIT_STRUCT = struct.Struct('<i')
+
+
+def pack_inventory(counts=None, default=10):
+    """Packs a {blood type: units} dict into the inventory column, filling gaps with default."""
+    counts = counts or {}
+    return INVENTORY_STRUCT.pack(*(counts.get(blood_type, default) for blood_type in BTYPE_IDX))
+
+
 class BloodBank(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(150), unique=True, nullable=False)
     location = db.Column(db.String(100), nullable=False)
 
-    # Simple inventory tracking by blood type (unit count)
-    A_pos = db.Column(db.Integer, default=10)
-    B_pos = db.Column(db.Integer, default=10)
-    O_pos = db.Column(db.Integer, default=10)
-    AB_pos = db.Column(db.Integer, default=10)
-    A_neg = db.Column(db.Integer, default=10)
-    B_neg = db.Column(db.Integer, default=10)
-    O_neg = db.Column(db.Integer, default=10)
-    AB_neg = db.Column(db.Integer, default=10)
+    # Simple inventory tracking by blood type (unit count), packed as 8 int32s
+    inventory = db.Column(db.LargeBinary(32), nullable=False, default=lambda: pack_inventory())
 
     # Relationships
-    posts = db.relationship('BloodPost', backref='blood_bank', lazy=True)
-    requests = db.relationship('BloodRequest', backref='target_bank', lazy=True)
+    posts = db.relationship('BloodPost', back_populates='blood_bank', lazy=True)
+    requests = db.relationship('BloodRequest', back_populates='target_bank', lazy=True)
 
     def get_inventory(self):
-        """Returns inventory as a dictionary."""
-        return {
-            "A+": self.A_pos, "B+": self.B_pos, "O+": self.O_pos, "AB+": self.AB_pos,
-            "A-": self.A_neg, "B-": self.B_neg, "O-": self.O_neg, "AB-": self.AB_neg,
-        }
+        """Returns inventory as a new dictionary, decoded from the packed column."""
+        return dict(zip(BTYPE_IDX, INVENTORY_STRUCT.unpack(self.inventory)))
 
     def update_inventory(self, blood_type, operation='donate'):
-        """Updates inventory based on donation or request."""
-        type_map = {
-            'A+': 'A_pos', 'B+': 'B_pos', 'O+': 'O_pos', 'AB+': 'AB_pos',
-            'A-': 'A_neg', 'B-': 'B_neg', 'O-': 'O_neg', 'AB-': 'AB_neg',
-        }
-        col_name = type_map.get(blood_type)
-        if not col_name:
+        """Updates inventory based on donation or request. The caller commits."""
+        idx = BTYPE_IDX.get(blood_type)
+        if idx is None:
             return False
 
-        current_value = getattr(self, col_name)
+        offset = idx * UNIT_STRUCT.size
+        buf = bytearray(self.inventory)
+        current_value, = UNIT_STRUCT.unpack_from(buf, offset)
 
         if operation == 'donate':
-            setattr(self, col_name, current_value + 1)
-            db.session.commit()
+            UNIT_STRUCT.pack_into(buf, offset, current_value + 1)
+            self.inventory = bytes(buf)
             return True
         elif operation == 'request' and current_value > 0:
-            setattr(self, col_name, current_value - 1)
-            db.session.commit()
+            UNIT_STRUCT.pack_into(buf, offset, current_value - 1)
+            self.inventory = bytes(buf)
             return True  # Request fulfilled
 
         return False  # Request could not be fulfilled (inventory too low)
@@ -70,76 +125,193 @@ class BloodBank(db.Model):
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(150), unique=True, nullable=False)
-    password_hash = db.Column(db.String(256), nullable=False)
+    password_hash = db.Column(db.String(512), nullable=False)
     blood_type = db.Column(db.String(3), nullable=False)
     location = db.Column(db.String(100), nullable=False)
     role = db.Column(db.String(10), nullable=False)  # donor or recipient
 
-    blood_posts = db.relationship('BloodPost', backref='author', lazy=True)
-    blood_requests = db.relationship('BloodRequest', backref='requester', lazy=True)
+    blood_posts = db.relationship('BloodPost', back_populates='author', lazy=True)
+    blood_requests = db.relationship('BloodRequest', back_populates='requester', lazy=True)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
 
 
 class BloodPost(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.String(255), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # Indexed for the donor dashboard; the rowid in the index also serves ORDER BY id DESC
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     blood_bank_id = db.Column(db.Integer, db.ForeignKey('blood_bank.id'), nullable=True)  # Where the blood went
 
+    author = db.relationship('User', back_populates='blood_posts')
+    blood_bank = db.relationship('BloodBank', back_populates='posts')
+
 
 class BloodRequest(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     blood_type_needed = db.Column(db.String(3), nullable=False)
     location_needed = db.Column(db.String(100), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # Indexed for the recipient dashboard's request list
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     blood_bank_id = db.Column(db.Integer, db.ForeignKey('blood_bank.id'), nullable=False)  # Which bank is targeted
     is_fulfilled = db.Column(db.Boolean, default=False)
 
+    requester = db.relationship('User', back_populates='blood_requests')
+    target_bank = db.relationship('BloodBank', back_populates='requests')
+
+
+# --- Query Helpers ---
+
+def loader_options(*options):
+    """Query options, plus raiseload('*') in debug so accidental lazy loads fail loudly."""
+    if app.debug:
+        return options + (raiseload('*'),)
+    return options
+
+
+def cached_stmt(fn):
+    """Wraps a select() lambda in lambda_stmt so its SQL is built once per call site.
+
+    Like loader_options, raiseload('*') is added in debug. Options must live inside
+    the lambda itself: only plain values in its closure become bound parameters.
+    """
+    stmt = lambda_stmt(fn)
+    if app.debug:
+        stmt += lambda s: s.options(raiseload('*'))
+    return stmt
+
+
+def lock_for_write():
+    """Takes SQLite's write lock now so rows read after this can't change before the commit."""
+    db.session.execute(text('BEGIN IMMEDIATE'))
+
+
+# Lists rendered in pages are capped at PER_PAGE rows; MAX_PAGE keeps OFFSET within SQLite's INTEGER range
+PER_PAGE = 25
+MAX_PAGE = 10000
+
+
+def current_page():
+    """Returns the 1-based ?page= argument of the current request, clamped to 1..MAX_PAGE."""
+    return min(max(request.args.get('page', 1, type=int), 1), MAX_PAGE)
+
+
+# Blood banks change rarely; serve the list from memory for a short while
+BANKS_CACHE_TTL = 60
+_banks_cache = {}
+
+
+def list_all_banks():
+    """Returns every blood bank as a plain dict, cached for BANKS_CACHE_TTL seconds."""
+    cached = _banks_cache.get('banks')
+    if cached and time.monotonic() - cached[0] < BANKS_CACHE_TTL:
+        return cached[1]
+
+    # Only the columns the directory shows; the inventory blob is read on the bank's own page
+    banks = [dict(row) for row in db.session.execute(
+        lambda_stmt(lambda: select(BloodBank.id, BloodBank.name, BloodBank.location))
+    ).mappings()]
+    _banks_cache['banks'] = (time.monotonic(), banks)
+    return banks
+
 
 # --- Routes ---
 
+@app.before_request
+def load_logged_in_user():
+    """Binds the logged in user (if any) to g.user via a primary key lookup."""
+    if request.endpoint == 'static':
+        # Assets never need the user; don't pay a query for every stylesheet
+        return
+    uid = session.get('uid')
+    g.user = db.session.get(User, uid) if uid is not None else None
+
+
+# Landing pages look the same for every anonymous visitor; let clients cache them briefly
+_landing_etags = {}
+
+
+def landing_etag(template_name):
+    """ETag of a landing page, derived from its template source (once per process outside debug)."""
+    etag = _landing_etags.get(template_name)
+    if etag is None:
+        source, _, _ = app.jinja_env.loader.get_source(app.jinja_env, template_name)
+        etag = hashlib.sha1(source.encode()).hexdigest()
+        if not app.debug:
+            _landing_etags[template_name] = etag
+    return etag
+
+
+def render_landing_page(template_name):
+    """Renders a landing page, or answers 304 without rendering if the client's copy is current."""
+    etag = landing_etag(template_name)
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = make_response(render_template(template_name))
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = 60
+    # Logging in changes the session cookie, which must bypass the cached anonymous page
+    response.vary.add('Cookie')
+    return response
+
+
 @app.route('/')
 def home():
     """Public home page (with flash animation)."""
-    if 'username' in session:
+    if g.user:
         return redirect(url_for('dashboard'))
-    return render_template('home.html')
+    return render_landing_page('home.html')
 
 
 @app.route('/index')
 def index():
     """Login/Register page."""
-    if 'username' in session:
+    if g.user:
         return redirect(url_for('dashboard'))
-    return render_template('index.html')
+    return render_landing_page('index.html')
 
 
 @app.route('/dashboard')
 def dashboard():
     """User dashboard - redirects based on role."""
-    if 'username' not in session:
+    user = g.user
+    if not user:
         return redirect(url_for('index'))
 
-    user = User.query.filter_by(username=session['username']).first()
+    user_id = user.id
+    page = current_page()
+    # Fetch one extra row to tell whether there is a next page
+    limit, offset = PER_PAGE + 1, (page - 1) * PER_PAGE
 
     if user.role == 'donor':
         # Donor specific data
-        posts = BloodPost.query.filter_by(user_id=user.id).order_by(BloodPost.id.desc()).all()
+        posts = db.session.execute(cached_stmt(
+            lambda: select(BloodPost).options(selectinload(BloodPost.blood_bank))
+            .where(BloodPost.user_id == user_id).order_by(BloodPost.id.desc())
+            .limit(limit).offset(offset)
+        )).scalars().all()
+        all_banks = list_all_banks()
         # Suggest banks nearby for donation
-        banks_nearby = BloodBank.query.filter_by(location=user.location).all()
-        all_banks = BloodBank.query.all()
-        return render_template('donor_dashboard.html', user=user, posts=posts, banks_nearby=banks_nearby,
-                               all_banks=all_banks)
+        banks_nearby = [bank for bank in all_banks if bank['location'] == user.location]
+        return render_template('donor_dashboard.html', user=user, posts=posts[:PER_PAGE],
+                               banks_nearby=banks_nearby, all_banks=all_banks,
+                               page=page, has_next=len(posts) > PER_PAGE)
 
     elif user.role == 'recipient':
         # Recipient specific data
-        requests = BloodRequest.query.filter_by(user_id=user.id).order_by(BloodRequest.id.desc()).all()
-        return render_template('recipient_dashboard.html', user=user, requests=requests)
+        requests = db.session.execute(cached_stmt(
+            lambda: select(BloodRequest).options(selectinload(BloodRequest.target_bank))
+            .where(BloodRequest.user_id == user_id).order_by(BloodRequest.id.desc())
+            .limit(limit).offset(offset)
+        )).scalars().all()
+        return render_template('recipient_dashboard.html', user=user, requests=requests[:PER_PAGE],
+                               page=page, has_next=len(requests) > PER_PAGE)
 
     # Should not happen
     return "Unknown role or profile error.", 400
@@ -150,10 +322,12 @@ def login():
     """Handle login."""
     username = request.form['username']
     password = request.form['password']
-    user = User.query.filter_by(username=username).first()
+    user = db.session.execute(
+        cached_stmt(lambda: select(User).where(User.username == username))
+    ).scalar_one_or_none()
 
     if user and user.check_password(password):
-        session['username'] = username
+        session['uid'] = user.id
         return redirect(url_for('dashboard'))
     return render_template('index.html', error="Invalid username or password.")
 
@@ -167,40 +341,48 @@ def register():
     location = request.form['location']
     role = request.form['role']
 
-    if User.query.filter_by(username=username).first():
+    username_taken = db.session.execute(
+        lambda_stmt(lambda: select(exists().where(User.username == username)))
+    ).scalar()
+    if username_taken:
         return render_template('index.html', error="Username already exists.")
 
     new_user = User(username=username, blood_type=blood_type, location=location, role=role)
     new_user.set_password(password)
     db.session.add(new_user)
     db.session.commit()
-    session['username'] = username
+    session['uid'] = new_user.id
     return redirect(url_for('dashboard'))
 
 
 @app.route('/logout')
 def logout():
     """Log out and return to home page."""
-    session.pop('username', None)
+    session.pop('uid', None)
     return redirect(url_for('home'))
 
 
 @app.route('/post_donation', methods=['POST'])
 def post_donation():
     """Donor action: Post a donation to a specific blood bank."""
-    if 'username' not in session:
+    user = g.user
+    if not user:
         return redirect(url_for('index'))
-
-    user = User.query.filter_by(username=session['username']).first()
     if user.role != 'donor':
         return redirect(url_for('dashboard'))
 
-    blood_bank_id = request.form.get('blood_bank_id')
+    blood_bank_id = request.form.get('blood_bank_id', type=int)
     content = request.form['content']
+    if blood_bank_id is None:
+        # Missing or malformed bank id (shouldn't happen with proper form)
+        return redirect(url_for('dashboard'))
 
-    bank = BloodBank.query.get(blood_bank_id)
+    # The whole inventory blob is rewritten, so read it under the write lock
+    lock_for_write()
+    bank = db.session.get(BloodBank, blood_bank_id, populate_existing=True)
     if not bank:
         # Bank not found (shouldn't happen with proper form)
+        db.session.rollback()
         return redirect(url_for('dashboard'))
 
     # 1. Update Blood Bank Inventory (Donation = +1 unit)
@@ -211,6 +393,8 @@ def post_donation():
                          user_id=user.id,
                          blood_bank_id=blood_bank_id)
     db.session.add(new_post)
+
+    # 3. Commit the inventory change and the post together
     db.session.commit()
 
     return redirect(url_for('dashboard'))
@@ -219,30 +403,33 @@ def post_donation():
 @app.route('/blood_banks')
 def blood_banks():
     """Recipient page: List all available blood banks."""
-    if 'username' not in session:
+    user = g.user
+    if not user:
         return redirect(url_for('index'))
-
-    user = User.query.filter_by(username=session['username']).first()
     if user.role != 'recipient':
         # Donors can also browse banks if needed, but primary feature for recipient
         return redirect(url_for('dashboard'))
 
-    all_banks = BloodBank.query.all()
-    return render_template('blood_banks.html', user=user, all_banks=all_banks)
+    page = current_page()
+    all_banks = list_all_banks()
+    page_banks = all_banks[(page - 1) * PER_PAGE:page * PER_PAGE]
+    return render_template('blood_banks.html', user=user, all_banks=page_banks,
+                           page=page, has_next=len(all_banks) > page * PER_PAGE)
 
 
 @app.route('/blood_bank_inventory/<int:bank_id>')
 def blood_bank_inventory(bank_id):
     """Recipient page: View detailed inventory of a single blood bank."""
-    if 'username' not in session:
+    user = g.user
+    if not user:
         return redirect(url_for('index'))
-
-    user = User.query.filter_by(username=session['username']).first()
     if user.role != 'recipient':
         # Deny access if not a recipient
         return redirect(url_for('dashboard'))
 
-    bank = BloodBank.query.get_or_404(bank_id)
+    bank = db.session.get(BloodBank, bank_id, options=loader_options())
+    if not bank:
+        abort(404)
     inventory = bank.get_inventory()
 
     # Blood types relevant to the current user (e.g. if they need O+, show who can give it)
@@ -255,17 +442,21 @@ def blood_bank_inventory(bank_id):
 @app.route('/request_blood', methods=['POST'])
 def request_blood():
     """Recipient action: Request blood from a specific bank."""
-    if 'username' not in session:
+    user = g.user
+    if not user:
         return redirect(url_for('index'))
-
-    user = User.query.filter_by(username=session['username']).first()
     if user.role != 'recipient':
         return redirect(url_for('dashboard'))
 
     blood_type_needed = request.form['blood_type_needed']
-    blood_bank_id = request.form['blood_bank_id']
+    blood_bank_id = request.form.get('blood_bank_id', type=int)
+    if blood_bank_id is None:
+        # Missing or malformed bank id (shouldn't happen with proper form)
+        return redirect(url_for('dashboard'))
 
-    bank = BloodBank.query.get(blood_bank_id)
+    # The whole inventory blob is rewritten, so read it under the write lock
+    lock_for_write()
+    bank = db.session.get(BloodBank, blood_bank_id, populate_existing=True)
 
     # 1. Check and Update Blood Bank Inventory (Request = -1 unit if available)
     is_fulfilled = False
@@ -279,23 +470,40 @@ def request_blood():
                                blood_bank_id=blood_bank_id,
                                is_fulfilled=is_fulfilled)
     db.session.add(new_request)
+
+    # 3. Commit the inventory change and the request together
     db.session.commit()
 
     return redirect(url_for('dashboard'))
 
 
+# --- CLI ---
+
+def seed_blood_banks():
+    """Initialize Blood Banks if none exist for demonstration purposes."""
+    # Take the write lock before counting so concurrent seeders can't both see an empty table
+    lock_for_write()
+    if db.session.execute(select(func.count()).select_from(BloodBank)).scalar() == 0:
+        print("Initializing Blood Banks...")
+        db.session.add(BloodBank(name='Central City Blood Center', location='New York',
+                                 inventory=pack_inventory({'O-': 3, 'A+': 50})))
+        db.session.add(BloodBank(name='Metropolitan General Hospital Bank', location='New York',
+                                 inventory=pack_inventory({'B+': 20, 'A-': 20})))
+        db.session.add(BloodBank(name='Dallas Community Bank', location='Dallas',
+                                 inventory=pack_inventory({'O+': 100, 'AB-': 1})))
+        db.session.add(BloodBank(name='San Diego LifeSource', location='San Diego',
+                                 inventory=pack_inventory()))
+    db.session.commit()
+
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create the tables and seed the demonstration blood banks."""
+    db.create_all()
+    seed_blood_banks()
+
+
 if __name__ == '__main__':
-    with app.app_context():
-        db.create_all()
-        # Initialize Blood Banks if none exist for demonstration purposes
-        if not BloodBank.query.first():
-            print("Initializing Blood Banks...")
-            db.session.add(BloodBank(name='Central City Blood Center', location='New York', O_neg=3, A_pos=50))
-            db.session.add(
-                BloodBank(name='Metropolitan General Hospital Bank', location='New York', B_pos=20, A_neg=20))
-            db.session.add(BloodBank(name='Dallas Community Bank', location='Dallas', O_pos=100, AB_neg=1))
-            db.session.add(
-                BloodBank(name='San Diego LifeSource', location='San Diego', A_pos=10, B_pos=10, O_pos=10, AB_pos=10,
-                          A_neg=10, B_neg=10, O_neg=10, AB_neg=10))
-            db.session.commit()
-    app.run(debug=True)
+    # Development server only; run `flask --app app init-db` once beforehand.
+    # Debug follows FLASK_DEBUG. In production use: gunicorn -c gunicorn.conf.py app:app
+    app.run()
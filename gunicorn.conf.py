@@ -0,0 +1,8 @@
+# Production server settings: gunicorn -c gunicorn.conf.py app:app
+import multiprocessing
+
+bind = "0.0.0.0:8000"
+workers = multiprocessing.cpu_count()
+# Threads hash passwords in parallel (argon2-cffi releases the GIL) and overlap SQLite reads
+worker_class = "gthread"
+threads = 8